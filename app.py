@@ -2,8 +2,20 @@ import streamlit as st
 import yfinance as yf
 import ta
 import pandas as pd
+import numpy as np
 import time
+import os
+import zipfile
+import pickle
+import hashlib
+import bisect
+import operator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta 
+from collections import deque
+import heapq
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import requests
 from bs4 import BeautifulSoup
 import pytz
@@ -84,22 +96,530 @@ COMMODITIES = {
     "Copper":"HG=F","Corn":"ZC=F","Wheat":"ZW=F"
 }
 
-@st.cache_data(ttl=60)
-def fetch(symbol, interval, period):
+MARKETS = {**CURRENCIES, **CRYPTO, **COMMODITIES}
+
+# ================= METRICS =================
+
+METRICS_FILE = os.environ.get("MALAGNA_METRICS_FILE")
+METRICS_PORT = os.environ.get("MALAGNA_METRICS_PORT")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_FAMILIES = {
+    "malagna_downloads": ("counter", "Yahoo downloads by interval and outcome"),
+    "malagna_download_seconds": ("histogram", "Yahoo download latency"),
+    "malagna_calendar_fetches": ("counter", "Forex Factory calendar fetches by outcome"),
+    "malagna_calendar_seconds": ("histogram", "Forex Factory fetch and parse latency"),
+    "malagna_scans": ("counter", "Completed market scans"),
+    "malagna_scan_seconds": ("histogram", "End-to-end scan latency"),
+    "malagna_signals": ("counter", "Signals generated by market cycle state"),
+    "malagna_cache_lookups": ("counter", "Cache lookups by cache"),
+    "malagna_cache_misses": ("counter", "Cache misses by cache"),
+    "malagna_stale_served": ("counter", "Stale frames served while revalidating, by interval"),
+    "malagna_stale_dropped": ("counter", "Frames dropped for being older than MAX_STALE_CANDLES, by interval"),
+    "malagna_hedged_downloads": ("counter", "Duplicate downloads issued after the hedge deadline"),
+    "malagna_fetch_budget_skips": ("counter", "Cold fetches skipped because the scan time budget ran out"),
+    "malagna_rate_limited": ("counter", "Downloads refused by the global request budget"),
+    "malagna_evaluations": ("counter", "Pair evaluations, re-run or reused from the last scan")
+}
 
-    try:
-        df = yf.download(symbol, interval=interval, period=period, progress=False)
+class Metrics:
+    """
+    Process-wide counters and latency histograms, shared by all sessions
+    and rendered in the OpenMetrics text format.
+    """
 
-        if df is None or df.empty:
-            return None
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            buckets, total, count = self.histograms.get(
+                key, ([0] * len(LATENCY_BUCKETS), 0.0, 0)
+            )
+            buckets = [
+                n + (seconds <= bound) for n, bound in zip(buckets, LATENCY_BUCKETS)
+            ]
+            self.histograms[key] = (buckets, total + seconds, count + 1)
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+
+        lines = []
+
+        for name, (kind, help_text) in METRIC_FAMILIES.items():
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {help_text}")
+
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}_total{format_labels(labels)} {value}")
+                continue
+
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, n in zip(LATENCY_BUCKETS, buckets):
+                    le = format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{le} {n}")
+                le = format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{le} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+@st.cache_resource
+def metrics():
+    return Metrics()
+
+def export_metrics():
+    """Writes the current metrics to MALAGNA_METRICS_FILE, if configured."""
+    if not METRICS_FILE:
+        return
+
+    tmp = METRICS_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(metrics().render())
+    os.replace(tmp, METRICS_FILE)
+
+@st.cache_resource
+def metrics_server(port):
+    """Serves /metrics on localhost from a daemon thread (started once)."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+
+            body = metrics().render().encode()
+            self.send_response(200)
+            self.send_header(
+                "Content-Type",
+                "application/openmetrics-text; version=1.0.0; charset=utf-8"
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if METRICS_PORT:
+    metrics_server(int(METRICS_PORT))
+
+# ================= PROVIDERS =================
+
+PROVIDER_MODE = os.environ.get("MALAGNA_PROVIDER", "live")   # live | record | replay
+ARCHIVE_PATH = os.environ.get("MALAGNA_ARCHIVE", "malagna_session.zip")
+
+FOREX_FACTORY_URL = os.environ.get("MALAGNA_CALENDAR_URL", "https://www.forexfactory.com/calendar")
+
+class LiveProvider:
+    """
+    Yahoo Finance and Forex Factory over the network, on wall-clock time.
+    """
+
+    def now(self):
+        return datetime.now(pytz.UTC)
 
-        df = df.dropna()
+    def begin_scan(self):
+        pass
+
+    def __init__(self):
+        self.batch_lock = threading.Lock()
+
+    def download(self, symbol, interval, period):
+        """
+        `symbol` may be a tuple of tickers for a batched download; the
+        frame then has (field, ticker) columns.
+        """
+        if isinstance(symbol, tuple):
+            # yf.download keeps module-level state, so one batch at a time
+            with self.batch_lock:
+                return yf.download(list(symbol), interval=interval, period=period, progress=False)
+
+        # Ticker.history keeps no module-level state, so concurrent
+        # (hedged / background) downloads don't interfere. raise_errors so
+        # Yahoo failures surface as errors instead of empty frames.
+        return yf.Ticker(symbol).history(interval=interval, period=period, raise_errors=True)
+
+    def calendar(self, timeout=10):
+        headers = {"User-Agent": "Mozilla/5.0"}
+        res = requests.get(FOREX_FACTORY_URL, headers=headers, timeout=timeout)
+        # error pages have no calendar rows and would parse as "no news"
+        res.raise_for_status()
+        return res.text
 
+class RecordingProvider(LiveProvider):
+    """
+    Live provider that appends every response (and every scan start)
+    to a zip archive. Responses identical to the previous one for the
+    same request are stored once.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.last_digest = {}
+
+        self.seq = 0
+        if os.path.exists(path):
+            with zipfile.ZipFile(path) as zf:
+                self.seq = len(zf.namelist())
+
+    def record(self, kind, key, data=None, error=None):
+        payload = pickle.dumps((data, error))
+        digest = hashlib.sha1(payload).hexdigest()
+
+        with self.lock:
+            if kind != "scan" and self.last_digest.get((kind, key)) == digest:
+                return
+            self.last_digest[(kind, key)] = digest
+
+            event = {"kind": kind, "key": key, "time": self.now(), "payload": payload}
+
+            with zipfile.ZipFile(self.path, "a", zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(f"{self.seq:08d}", pickle.dumps(event))
+            self.seq += 1
+
+    def begin_scan(self):
+        self.record("scan", None)
+
+    def download(self, symbol, interval, period):
+        key = (symbol, interval, period)
+        try:
+            df = super().download(symbol, interval, period)
+        except Exception as e:
+            self.record("download", key, error=repr(e))
+            raise
+        self.record("download", key, data=df)
         return df
 
-    except:
+    def calendar(self, timeout=10):
+        try:
+            text = super().calendar(timeout)
+        except Exception as e:
+            self.record("calendar", FOREX_FACTORY_URL, error=repr(e))
+            raise
+        self.record("calendar", FOREX_FACTORY_URL, data=text)
+        return text
+
+class ReplayProvider:
+    """
+    Serves a recorded archive from memory on a simulated clock.
+    Each scan_all_markets call advances the clock to the next recorded
+    scan and sees the latest responses recorded up to that scan.
+    """
+
+    def __init__(self, path):
+        self.responses = {}
+        self.scans = []
+
+        with zipfile.ZipFile(path) as zf:
+            for name in sorted(zf.namelist()):
+                event = pickle.loads(zf.read(name))
+
+                if event["kind"] == "scan":
+                    self.scans.append(event["time"])
+                    continue
+
+                data, error = pickle.loads(event["payload"])
+                self.responses.setdefault((event["kind"], event["key"]), []).append(
+                    (len(self.scans), data, error)
+                )
+
+        self.cursor = 0
+        self.clock = self.scans[0] if self.scans else datetime.now(pytz.UTC)
+
+    def now(self):
+        return self.clock
+
+    def remaining_scans(self):
+        return len(self.scans) - self.cursor
+
+    def rewind(self):
+        """Back to the first recorded scan."""
+        self.cursor = 0
+        if self.scans:
+            self.clock = self.scans[0]
+
+    def begin_scan(self):
+        if self.cursor < len(self.scans):
+            self.clock = self.scans[self.cursor]
+            self.cursor += 1
+
+    def lookup(self, kind, key):
+        history = self.responses.get((kind, key))
+        if not history:
+            raise LookupError(f"No recorded {kind} for {key}")
+
+        # latest response recorded during or before the current scan
+        k = bisect.bisect_right([scan for scan, _, _ in history], self.cursor) - 1
+        _, data, error = history[max(k, 0)]
+
+        if error:
+            raise RuntimeError(error)
+        return data
+
+    def download(self, symbol, interval, period):
+        return self.lookup("download", (symbol, interval, period))
+
+    def calendar(self, timeout=10):
+        return self.lookup("calendar", FOREX_FACTORY_URL)
+
+@st.cache_resource
+def _provider(mode, path):
+    if mode == "record":
+        return RecordingProvider(path)
+    if mode == "replay":
+        return ReplayProvider(path)
+    return LiveProvider()
+
+def provider():
+    return _provider(PROVIDER_MODE, ARCHIVE_PATH)
+
+# ================= CANDLES =================
+
+INTERVALS = {
+    "1m": timedelta(minutes=1),
+    "5m": timedelta(minutes=5),
+    "15m": timedelta(minutes=15),
+    "30m": timedelta(minutes=30),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1)
+}
+
+CACHE_ENTRIES = 512
+
+def next_candle_close(now, candle=INTERVALS["5m"]):
+    """First candle boundary strictly after `now` (UTC-aligned)."""
+    epoch = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+    elapsed = (now - epoch) // candle
+    return epoch + (elapsed + 1) * candle
+
+def candle_boundary(interval):
+    """Close time of the candle currently forming on `interval`."""
+    return next_candle_close(provider().now(), INTERVALS[interval])
+
+def fetch(symbol, interval, period):
+    """
+    Closed candles for `symbol`, cached until the current candle on `interval`
+    closes. df.attrs carries the boundary it was fetched for, its age in
+    seconds and whether it is stale. Returns None when no data is available.
+    """
+    metrics().inc("malagna_cache_lookups", cache="candles")
+    boundary = candle_boundary(interval)
+
+    if FETCH_MODE == "swr":
+        return fetch_swr(symbol, interval, period, boundary)
+
+    try:
+        df = _download(symbol, interval, period, boundary)
+    except Exception:
         return None
 
+    df.attrs.update(boundary=boundary, age=0.0, stale=False)
+    return df
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def _download(symbol, interval, period, boundary):
+
+    metrics().inc("malagna_cache_misses", cache="candles")
+    charge_request_budget(symbol, interval)
+    return closed_candles(download_candles(symbol, interval, period), interval, boundary)
+
+def closed_candles(df, interval, boundary):
+    """
+    Drops the candle still forming before `boundary`, so a cached frame
+    really is final until the next close.
+    """
+    index = df.index if df.index.tz is not None else df.index.tz_localize("UTC")
+    return df[index < boundary - INTERVALS[interval]]
+
+def download_candles(symbol, interval, period):
+    """One provider download. Raises on failure or empty data."""
+    started = time.perf_counter()
+
+    try:
+        df = provider().download(symbol, interval, period)
+    except Exception:
+        metrics().inc("malagna_downloads", interval=interval, outcome="error")
+        raise
+    finally:
+        metrics().observe("malagna_download_seconds", time.perf_counter() - started, interval=interval)
+
+    if df is None or df.empty:
+        metrics().inc("malagna_downloads", interval=interval, outcome="empty")
+        raise ValueError(f"No data for {symbol} {interval}")
+
+    metrics().inc("malagna_downloads", interval=interval, outcome="ok")
+
+    # batches mix trading hours, so only drop rows empty for every ticker
+    if isinstance(symbol, tuple):
+        return df.dropna(how="all")
+    return df.dropna()
+
+# ================= STALE-WHILE-REVALIDATE =================
+
+FETCH_MODE = os.environ.get("MALAGNA_FETCH_MODE", "blocking")   # blocking | swr
+
+SCAN_TIME_BUDGET = 20   # seconds a scan may wait on cold downloads
+DOWNLOAD_TIMEOUT = 15   # seconds before a download (and its hedge) is abandoned
+HEDGE_AFTER = 3         # seconds before a slow download is duplicated
+MAX_STALE_CANDLES = 3   # candles a stale frame may lag before the pair is dropped
+
+class CandleStore:
+    """
+    Last good frame per (symbol, interval, period), shared by all sessions.
+    Refreshes run on a background pool; concurrent refreshes of the same
+    key are collapsed into one.
+    """
+
+    def __init__(self, workers=8):
+        self.refreshes = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="refresh")
+        self.downloads = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="download")
+        self.lock = threading.Lock()
+        self.frames = {}
+        self.inflight = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.frames.get(key)
+
+    def refresh(self, key, boundary):
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is None:
+                future = self.refreshes.submit(self._refresh, key, boundary)
+                self.inflight[key] = future
+            return future
+
+    def _refresh(self, key, boundary):
+        try:
+            charge_request_budget(*key[:2])
+            df = closed_candles(hedged_download(self.downloads, *key), key[1], boundary)
+            entry = (df, boundary, provider().now())
+            with self.lock:
+                self.frames[key] = entry
+            return entry
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+@st.cache_resource
+def candle_store():
+    return CandleStore()
+
+def hedged_download(pool, symbol, interval, period, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Starts a download and, if it hasn't succeeded within HEDGE_AFTER
+    seconds, a duplicate. Returns whichever succeeds first.
+    """
+    deadline = time.monotonic() + timeout
+    pending = {pool.submit(download_candles, symbol, interval, period)}
+    hedged = False
+    error = None
+
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        wait_for = remaining if hedged else min(HEDGE_AFTER, remaining)
+        done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+
+        if not hedged:
+            hedged = True
+            metrics().inc("malagna_hedged_downloads", interval=interval)
+            pending.add(pool.submit(download_candles, symbol, interval, period))
+
+    raise error or TimeoutError(f"Download timed out: {symbol} {interval}")
+
+def scan_time_left():
+    deadline = st.session_state.get("scan_deadline")
+    if deadline is None:
+        return DOWNLOAD_TIMEOUT
+    return max(0.0, deadline - time.monotonic())
+
+def fetch_swr(symbol, interval, period, boundary):
+    """
+    Refreshes the last good frame in the background once its candle has
+    closed, waiting up to HEDGE_AFTER seconds for it before serving the
+    stale frame instead. Only a symbol with no frame yet waits for the full
+    download; no wait outlasts the scan's time budget. Frames more than
+    MAX_STALE_CANDLES behind are not served at all.
+    """
+    store = candle_store()
+    key = (symbol, interval, period)
+    entry = store.get(key)
+
+    if entry is None or entry[1] != boundary:
+        metrics().inc("malagna_cache_misses", cache="candles")
+        future = store.refresh(key, boundary)
+
+        if entry is None:
+            timeout = min(DOWNLOAD_TIMEOUT, scan_time_left())
+            if timeout <= 0:
+                metrics().inc("malagna_fetch_budget_skips", interval=interval)
+                return None
+            try:
+                entry = future.result(timeout=timeout)
+            except Exception:
+                return None
+        else:
+            try:
+                entry = future.result(timeout=min(HEDGE_AFTER, scan_time_left()))
+            except Exception:
+                if boundary - entry[1] > MAX_STALE_CANDLES * INTERVALS[interval]:
+                    metrics().inc("malagna_stale_dropped", interval=interval)
+                    return None
+                metrics().inc("malagna_stale_served", interval=interval)
+
+    df, fetched_for, fetched_at = entry
+    df = df.copy(deep=False)
+    df.attrs = {
+        "boundary": fetched_for,
+        "age": (provider().now() - fetched_at).total_seconds(),
+        "stale": fetched_for != boundary
+    }
+    return df
+
 def indicators(df):
     if df is None or df.empty or "Close" not in df.columns:
         return None
@@ -321,30 +841,6 @@ def range_quality(indicators):
 
     return "POOR"
 
-def detect_trend_pullback(indicators, direction):
-
-    close = indicators["close"]
-    ema20 = indicators["ema20"]
-    rsi = indicators["rsi"]
-
-    price = close.iloc[-1]
-    ema = ema20.iloc[-1]
-    rsi_now = rsi.iloc[-1]
-
-    # Distance to EMA
-    near_ema = abs(price - ema) / price < 0.005  # 0.5% tolerance
-
-    if direction == "BULLISH":
-        # Pullback = price near EMA and RSI cooled
-        if price <= ema and rsi_now < 55:
-            return True
-
-    if direction == "BEARISH":
-        if price >= ema and rsi_now > 45:
-            return True
-
-    return False
-
 def classify_market_state(structure, phase):
 
     if structure == "BULLISH" and phase == "CONTINUATION":
@@ -369,7 +865,7 @@ def pair_is_on_cooldown(pair):
     # 15 minute cooldown
     cooldown = timedelta(minutes=15)
 
-    return datetime.now() - last_time < cooldown
+    return provider().now() - last_time < cooldown
 
 def classify_market_environment(df, indicators):
 
@@ -581,6 +1077,32 @@ def detect_breakout(df):
 
     return None
 
+def range_edge(df, indicators):
+    """
+    "SUPPORT" / "RESISTANCE" when price sits within 0.2% of the
+    20-candle low / high, else None.
+    """
+    highs = df["High"]
+    lows = df["Low"]
+
+    # Fix yfinance multi-column issue
+    if isinstance(highs, pd.DataFrame):
+        highs = highs.iloc[:,0]
+    if isinstance(lows, pd.DataFrame):
+        lows = lows.iloc[:,0]
+
+    resistance = float(highs.astype(float).iloc[-20:].max())
+    support = float(lows.astype(float).iloc[-20:].min())
+    price = float(indicators["close"].iloc[-1])
+
+    if price <= support * 1.002:
+        return "SUPPORT"
+
+    if price >= resistance * 0.998:
+        return "RESISTANCE"
+
+    return None
+
 # ===== ADD THIS FUNCTION HERE =====
 
 def detect_market_cycle(df, indicators):
@@ -638,13 +1160,43 @@ def forex_factory_red_news(currencies, window_minutes=30):
     Returns True if high-impact (red) news is within ±window_minutes
     for the given currencies.
     """
-    try:
-        url = "https://www.forexfactory.com/calendar"
-        headers = {"User-Agent": "Mozilla/5.0"}
-        res = requests.get(url, headers=headers, timeout=10)
-        soup = BeautifulSoup(res.text, "html.parser")
+    metrics().inc("malagna_cache_lookups", cache="calendar")
+
+    # at most one fetch per candle (failures included), bounded by what is
+    # left of the scan's time budget
+    timeout = min(10, max(1, scan_time_left()))
+    events = _red_news_events(candle_boundary("5m"), timeout)
+    now = provider().now()
+
+    for cur, event_at in events:
+        if cur not in currencies:
+            continue
+
+        event_time = now.replace(
+            hour=event_at.hour, minute=event_at.minute,
+            second=0, microsecond=0
+        )
+
+        diff = abs((event_time - now).total_seconds()) / 60
+        if diff <= window_minutes:
+            return True
 
-        now = datetime.utcnow().replace(tzinfo=pytz.UTC)
+    return False
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def _red_news_events(boundary, _timeout):
+    """
+    (currency, UTC time) of timed high-impact events, fetched once per M5
+    candle for every pair and session. A failed fetch counts as no news
+    until the next candle.
+    """
+    metrics().inc("malagna_cache_misses", cache="calendar")
+    started = time.perf_counter()
+    outcome = "ok"
+    events = []
+
+    try:
+        soup = BeautifulSoup(provider().calendar(_timeout), "html.parser")
 
         for row in soup.select("tr.calendar__row"):
             impact = row.select_one(".impact span")
@@ -658,202 +1210,768 @@ def forex_factory_red_news(currencies, window_minutes=30):
             if "high" not in impact.get("class", []):
                 continue
 
-            cur = currency.text.strip()
-            if cur not in currencies:
-                continue
-
             time_text = time_cell.text.strip()
             if time_text in ["All Day", "Tentative", ""]:
                 continue
 
-            event_time = datetime.strptime(time_text, "%H:%M")
-            event_time = event_time.replace(
-                year=now.year, month=now.month, day=now.day,
-                tzinfo=pytz.UTC
-            )
-
-            diff = abs((event_time - now).total_seconds()) / 60
-            if diff <= window_minutes:
-                return True
+            event_at = datetime.strptime(time_text, "%H:%M").time()
+            events.append((currency.text.strip(), event_at))
 
     except Exception:
-        pass
+        outcome = "error"
+        events = []
 
-    return False
+    finally:
+        metrics().inc("malagna_calendar_fetches", outcome=outcome)
+        metrics().observe("malagna_calendar_seconds", time.perf_counter() - started)
 
-def scan_all_markets():
+    return events
 
-    best_trade = None
+# ================= CORRELATION =================
 
-    for asset, symbol in CURRENCIES.items():
+CORRELATION_WINDOW = 288        # 24h of M5 candles
+CORRELATION_MIN_CANDLES = 30
+CORRELATION_THRESHOLD = 0.8
+CORRELATION_MAX_LAG = timedelta(hours=1)
 
-        if pair_is_on_cooldown(asset):
-            continue
+class RollingCorrelation:
+    """
+    Rolling M5 return-correlation matrix across the pair universe.
+    Keeps running sums over the last `window` candles, so each new
+    candle only adds/removes its own row instead of recomputing the window.
+    """
 
-        # ===== NEWS FILTER =====
-        base, quote = asset.split("/")
-        if forex_factory_red_news([base, quote]):
-            continue
+    def __init__(self, assets, window=CORRELATION_WINDOW):
+        self.assets = list(assets)
+        self.window = window
 
-        # ===== HIGHER TIMEFRAME (H1) =====
-        df_h1 = fetch(symbol, "1h", "30d")
-        i_h1 = indicators(df_h1)
+        n = len(self.assets)
+        self.rows = deque()
+        self.sum = np.zeros(n)
+        self.cross = np.zeros((n, n))
 
-        if df_h1 is None or df_h1.empty or i_h1 is None:
-            continue
+        self.latest = {}
+        self.last_time = None
+        self.last_close = None
 
-        htf_direction = detect_direction(i_h1)
+    def update(self, closes):
+        """
+        closes: {asset: close Series} for the pairs refreshed this scan.
+        Candles are only folded in once every live pair has printed them,
+        so pairs refreshed less often don't distort the matrix.
+        Missing quotes count as flat.
+        """
+        self.latest.update(closes)
 
-        if htf_direction == "NEUTRAL":
-            continue
+        if not self.latest:
+            return
 
-        # ===== M5 =====
-        df = fetch(symbol, "5m", "3d")
-        i = indicators(df)
+        ends = {asset: s.index[-1] for asset, s in self.latest.items()}
+        newest = max(ends.values())
+        frontier = min(t for t in ends.values() if newest - t <= CORRELATION_MAX_LAG)
 
-        if df is None or df.empty or i is None:
-            continue
-      
-        cycle = detect_market_cycle(df, i)
-        m5_direction = detect_direction(i)
+        frame = pd.DataFrame(self.latest).reindex(columns=self.assets).sort_index()
+        frame = frame[frame.index <= frontier]
 
-        if htf_direction == "NEUTRAL":
-            continue
+        if self.last_time is not None:
+            frame = frame[frame.index > self.last_time]
 
-        adx = i["adx"].iloc[-1]
-        breakout = detect_breakout(df)
-        movement = movement_reality(i)
+        if frame.empty:
+            return
 
-        if movement == "CHAOTIC" and cycle != "EXPANSION":
-            continue
-        
-        pullback_ready = detect_trend_pullback(i, m5_direction)
-
-        signal = None
-        confidence = 0
-        reason = ""
-
-        # ===== ENTRY LOGIC =====
-        if cycle == "TREND":
-
-            if pullback_ready:
-                signal = "BUY" if m5_direction == "BULLISH" else "SELL"
-                confidence = 90
-                reason = "Trend pullback entry"
-        
-            elif m5_direction == "BULLISH" and adx > 18:
-                signal = "BUY"
-                confidence = 75
-                reason = "Early trend continuation"
-        
-            elif m5_direction == "BEARISH" and adx > 18:
-                signal = "SELL"
-                confidence = 75
-                reason = "Early trend continuation"
-        
-            # 🔥 Secondary momentum entry (ONLY if nothing triggered above)
-            elif not pullback_ready and movement in ["CLEAN", "MODERATE"] and adx > 22:
-                signal = "BUY" if m5_direction == "BULLISH" else "SELL"
-                confidence = 72
-                reason = "Momentum continuation"
-            
-        elif cycle == "CONSOLIDATION":
-        
-            highs = df["High"]
-            lows = df["Low"]
-            
-            # Fix yfinance multi-column issue
-            if isinstance(highs, pd.DataFrame):
-                highs = highs.iloc[:,0]
-            
-            if isinstance(lows, pd.DataFrame):
-                lows = lows.iloc[:,0]
-            
-            highs = highs.astype(float).iloc[-20:]
-            lows = lows.astype(float).iloc[-20:]
-            resistance = float(highs.max())
-            support = float(lows.min())
-            
-            price = float(i["close"].iloc[-1])
-            
-            if price <= support * 1.002:
-                signal = "BUY"
-                confidence = 75
-                reason = "Range support bounce"
-        
-            elif price >= resistance * 0.998:
-                signal = "SELL"
-                confidence = 75
-                reason = "Range resistance bounce"
-        
-        elif cycle == "EXPANSION":
-        
-            if breakout == "BREAKOUT_UP":
-                signal = "BUY"
-                confidence = 85
-                reason = "Range breakout"
-        
-            elif breakout == "BREAKOUT_DOWN":
-                signal = "SELL"
-                confidence = 85
-                reason = "Range breakout"
-        
-        elif cycle == "PRE_BREAKOUT":
-
-            if breakout == "BREAKOUT_UP":
-                signal = "BUY"
-                confidence = 80
-                reason = "Pre-breakout expansion"
-        
-            elif breakout == "BREAKOUT_DOWN":
-                signal = "SELL"
-                confidence = 80
-                reason = "Pre-breakout expansion"
-
-        elif cycle == "TRANSITION":
-
-            if breakout == "BREAKOUT_UP":
-                signal = "BUY"
-                confidence = 70
-                reason = "Transition breakout"
-        
-            elif breakout == "BREAKOUT_DOWN":
-                signal = "SELL"
-                confidence = 70
-                reason = "Transition breakout"
-
-       # ===== HTF CONTEXT ADJUSTMENT =====
-
-        if signal:
-        
-            if signal == "BUY" and htf_direction == "BULLISH":
-                confidence += 10
-        
-            elif signal == "SELL" and htf_direction == "BEARISH":
-                confidence += 10
-        
+        if self.last_close is not None:
+            frame = pd.concat([self.last_close.to_frame().T, frame])
+
+        frame = frame.ffill()
+        returns = frame.pct_change(fill_method=None).iloc[1:].fillna(0.0)
+        returns = returns.to_numpy()[-self.window:]
+
+        self.sum += returns.sum(axis=0)
+        self.cross += returns.T @ returns
+        self.rows.extend(returns)
+
+        overflow = len(self.rows) - self.window
+        if overflow > 0:
+            old = np.array([self.rows.popleft() for _ in range(overflow)])
+            self.sum -= old.sum(axis=0)
+            self.cross -= old.T @ old
+
+        self.last_time = frame.index[-1]
+        self.last_close = frame.iloc[-1]
+
+    def matrix(self):
+        n = len(self.assets)
+        count = len(self.rows)
+
+        if count < 2:
+            return pd.DataFrame(np.eye(n), index=self.assets, columns=self.assets)
+
+        mean = self.sum / count
+        cov = self.cross / count - np.outer(mean, mean)
+        std = np.sqrt(np.clip(np.diag(cov), 0, None))
+        denom = np.outer(std, std)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = np.where(denom > 0, cov / denom, 0.0)
+
+        np.fill_diagonal(corr, 1.0)
+        return pd.DataFrame(corr, index=self.assets, columns=self.assets)
+
+    def clusters(self, threshold=CORRELATION_THRESHOLD):
+        """
+        Maps each asset to a cluster id. Pairs are linked when
+        |correlation| >= threshold (inverse moves are the same trade).
+        """
+        n = len(self.assets)
+
+        if len(self.rows) < CORRELATION_MIN_CANDLES:
+            return {asset: k for k, asset in enumerate(self.assets)}
+
+        linked = np.abs(self.matrix().to_numpy()) >= threshold
+        labels = [-1] * n
+
+        for start in range(n):
+            if labels[start] != -1:
+                continue
+            labels[start] = start
+            stack = [start]
+            while stack:
+                k = stack.pop()
+                for j in np.flatnonzero(linked[k]):
+                    if labels[j] == -1:
+                        labels[j] = start
+                        stack.append(j)
+
+        return dict(zip(self.assets, labels))
+
+def strongest_per_cluster(candidates, clusters):
+    """
+    Keeps only the highest-confidence signal from each correlation cluster,
+    strongest first.
+    """
+    best = {}
+
+    for trade in candidates:
+        key = clusters.get(trade["asset"], trade["asset"])
+        if key not in best or trade["confidence"] > best[key]["confidence"]:
+            best[key] = trade
+
+    return sorted(best.values(), key=lambda t: t["confidence"], reverse=True)
+
+def cluster_representatives(shortlist, clusters):
+    """
+    The shortlisted asset with the strongest H1 trend (screen ADX) in each
+    correlation cluster. Only these get a full evaluation.
+    """
+    best = {}
+
+    for asset, (_, adx) in shortlist.items():
+        key = clusters.get(asset, asset)
+        if key not in best or adx > shortlist[best[key]][1]:
+            best[key] = asset
+
+    return set(best.values())
+
+# ================= SCHEDULER =================
+
+CANDLE = INTERVALS["5m"]
+MAX_REFRESH_CANDLES = 6
+
+# Global download budget shared by every session, charged per Yahoo
+# request actually made (cache hits are free). The burst covers the hourly
+# H1 batch (one request per symbol) plus a full M5 refresh.
+MAX_REQUESTS_PER_MINUTE = 40
+MAX_REQUEST_BURST = 80
+
+# Base refresh interval (in M5 candles) per market cycle
+REFRESH_CANDLES = {
+    "PRE_BREAKOUT": 1,
+    "EXPANSION": 1,
+    "TREND": 1,
+    "UNKNOWN": 1,
+    "CONSOLIDATION": 2,
+    "TRANSITION": 3
+}
+
+class RequestBudget:
+    """
+    Token bucket limiting downloads per minute across all sessions.
+    """
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = provider().now().timestamp()
+        self.lock = threading.Lock()
+
+    def take(self, cost):
+        with self.lock:
+            now = provider().now().timestamp()
+            # a rewound replay clock must not drain the bucket
+            elapsed = max(0.0, now - self.updated)
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+            if self.tokens < cost:
+                return False
+
+            self.tokens -= cost
+            return True
+
+@st.cache_resource
+def request_budget():
+    return RequestBudget(MAX_REQUESTS_PER_MINUTE, MAX_REQUEST_BURST)
+
+def charge_request_budget(symbol, interval):
+    """
+    Takes the download's Yahoo requests (one per symbol, batches included)
+    from the shared budget; raises when it is spent.
+    """
+    cost = len(symbol) if isinstance(symbol, tuple) else 1
+    if not request_budget().take(cost):
+        metrics().inc("malagna_rate_limited", interval=interval)
+        raise RuntimeError(f"Request budget exhausted: {symbol} {interval}")
+
+class RefreshScheduler:
+    """
+    Priority queue of symbols keyed on when they next need a refresh.
+    Pairs near a setup are due every candle, quiet ones every few candles;
+    higher volatility pulls a pair forward.
+    """
+
+    def __init__(self, assets):
+        self.queue = []
+        self.due_at = {}
+        self.results = {}
+        self.deferred = set()
+
+        start = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+        for asset in assets:
+            self.push(asset, start, 0)
+
+    def push(self, asset, due, priority):
+        self.due_at[asset] = due
+        heapq.heappush(self.queue, (due, -priority, asset))
+
+    def due(self, now, eligible=None):
+        """
+        Pops every symbol due by `now`, most urgent first, so the request
+        budget goes to the pairs that matter. Symbols outside `eligible`
+        stay due for the next scan.
+        """
+        ready = []
+        seen = set()
+
+        while self.queue and self.queue[0][0] <= now:
+            due, rank, asset = heapq.heappop(self.queue)
+            # skip entries superseded by a later reschedule
+            if self.due_at.get(asset) == due and asset not in seen:
+                seen.add(asset)
+                ready.append((rank, due, asset))
+
+        ready.sort()
+        admitted = []
+
+        for rank, due, asset in ready:
+            if eligible is not None and asset not in eligible:
+                heapq.heappush(self.queue, (due, rank, asset))
             else:
-                confidence -= 10
-
-        if signal:
-
-            last_close = df.index[-1].to_pydatetime()
-            minute = (last_close.minute // 5 + 1) * 5
-            entry_time = last_close.replace(minute=0, second=0, microsecond=0) + timedelta(minutes=minute)
-            expiry_time = entry_time + timedelta(minutes=5)
-
-            best_trade = {
-                "state": cycle,
-                "direction": m5_direction,
-                "asset": asset,
-                "signal": signal,
-                "confidence": confidence,
-                "personality": reason,
-                "entry": entry_time.strftime("%H:%M"),
-                "expiry": expiry_time.strftime("%H:%M")
-            }
+                admitted.append(asset)
+
+        return admitted
+
+    def reschedule(self, asset, now, cycle="UNKNOWN", hot=False, volatility=1.0):
+        if hot:
+            candles = 1
+        else:
+            candles = REFRESH_CANDLES.get(cycle, 1) / max(volatility, 0.1)
+            candles = min(MAX_REFRESH_CANDLES, max(1, round(candles)))
+
+        due = next_candle_close(now) + (candles - 1) * CANDLE
+        self.deferred.discard(asset)
+        self.push(asset, due, volatility / candles)
+
+    def defer(self, asset, now, candles=MAX_REFRESH_CANDLES):
+        """Moves `asset` to the slowest refresh cadence."""
+        self.deferred.add(asset)
+        self.push(asset, next_candle_close(now) + (candles - 1) * CANDLE, 0)
+
+    def promote(self, assets, now):
+        """Makes deferred assets among `assets` due right away."""
+        for asset in self.deferred & set(assets):
+            self.deferred.discard(asset)
+            self.push(asset, now, 0)
+
+    def remember(self, asset, now, trade):
+        self.results[asset] = (next_candle_close(now), trade)
+
+    def current_trades(self, now):
+        """
+        Signals evaluated during the current candle, including pairs
+        that were not due for a refresh on this scan.
+        """
+        boundary = next_candle_close(now)
+        return [
+            trade for seen, trade in self.results.values()
+            if trade and seen == boundary
+        ]
+
+def refresh_profile(df, indicators):
+    """
+    Range-edge proximity and ATR ratio used to prioritise the next refresh.
+    """
+    at_edge = range_edge(df, indicators) is not None
+
+    atr = indicators["atr"]
+    atr_avg = atr.rolling(30).mean().iloc[-1]
+    volatility = float(atr.iloc[-1] / atr_avg) if atr_avg > 0 else 1.0
+
+    return at_edge, volatility
+
+# ================= SCREENER =================
+
+SCREEN_MIN_ADX = 15
+
+def screen_universe(markets):
+    """
+    Stage 1: one batched H1 download for the whole universe, scored
+    column-wise. Returns {asset: (H1 direction, H1 ADX)} for the assets worth
+    a full M5 evaluation. If the batch fails, the last good shortlist is
+    reused for up to MAX_STALE_CANDLES hours, then stage 2 is skipped.
+    """
+    symbols = tuple(markets.values())
+    df = fetch(symbols, "1h", "30d")
+    last = last_screen()
+
+    if df is None:
+        boundary = candle_boundary("1h")
+        if last.get("boundary") and boundary - last["boundary"] <= MAX_STALE_CANDLES * INTERVALS["1h"]:
+            metrics().inc("malagna_stale_served", interval="1h")
+            return last["shortlist"]
+        metrics().inc("malagna_stale_dropped", interval="1h")
+        return {}
+
+    metrics().inc("malagna_cache_lookups", cache="screen")
+    screened = _screen(symbols, df.attrs["boundary"], df)
+
+    shortlist = {
+        asset: screened[symbol]
+        for asset, symbol in markets.items()
+        if screened[symbol][0] is not None
+    }
+    last.update(boundary=df.attrs["boundary"], shortlist=shortlist)
+    return shortlist
+
+@st.cache_resource
+def last_screen():
+    """Last good stage-1 shortlist, shared by all sessions."""
+    return {}
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def _screen(symbols, boundary, _df):
+
+    metrics().inc("malagna_cache_misses", cache="screen")
+
+    close = _df["Close"].reindex(columns=list(symbols)).astype(float)
+    high = _df["High"].reindex(columns=list(symbols)).astype(float)
+    low = _df["Low"].reindex(columns=list(symbols)).astype(float)
+
+    # ignore_na: each column behaves as if computed on its own candles only
+    def ema(frame, span):
+        return frame.ewm(span=span, adjust=False, min_periods=span, ignore_na=True).mean()
+
+    def wilder(frame):
+        return frame.ewm(alpha=1 / 14, adjust=False, ignore_na=True).mean()
+
+    # --- EMA alignment (same as detect_direction) ---
+    ema20 = ema(close, 20).ffill().iloc[-1]
+    ema50 = ema(close, 50).ffill().iloc[-1]
+    ema100 = ema(close, 100).ffill().iloc[-1]
+
+    bullish = (ema20 > ema50) & (ema50 > ema100)
+    bearish = (ema20 < ema50) & (ema50 < ema100)
+
+    # --- ADX (Wilder) ---
+    prev_close = close.ffill().shift()
+    up = high - high.ffill().shift()
+    down = low.ffill().shift() - low
+
+    plus_dm = up.where((up > down) & (up > 0), 0.0).where(high.notna())
+    minus_dm = down.where((down > up) & (down > 0), 0.0).where(low.notna())
+
+    tr = np.maximum(high - low, np.maximum((high - prev_close).abs(), (low - prev_close).abs()))
+    atr = wilder(tr)
+
+    plus_di = 100 * wilder(plus_dm) / atr
+    minus_di = 100 * wilder(minus_dm) / atr
+    dx = 100 * (plus_di - minus_di).abs() / (plus_di + minus_di)
+    adx = wilder(dx).ffill().iloc[-1]
+
+    strong = adx > SCREEN_MIN_ADX
+
+    screened = {}
+    for symbol in symbols:
+        if strong[symbol] and bullish[symbol]:
+            screened[symbol] = ("BULLISH", float(adx[symbol]))
+        elif strong[symbol] and bearish[symbol]:
+            screened[symbol] = ("BEARISH", float(adx[symbol]))
+        else:
+            screened[symbol] = (None, float(adx[symbol]))
+
+    return screened
+
+# ================= RULES =================
+
+WITH_M5 = "WITH_M5"   # signal follows the M5 EMA direction
+
+# Feature name -> (dependencies, function of those dependencies).
+# "asset", "symbol" and "htf_direction" (from the stage-1 screen) are
+# seeded per pair.
+FEATURES = {
+    "red_news": (("asset",), lambda asset: forex_factory_red_news(asset.split("/"))),
+    "df": (("symbol",), lambda symbol: fetch(symbol, "5m", "3d")),
+    "i": (("df",), indicators),
+    "cycle": (("df", "i"), detect_market_cycle),
+    "m5_direction": (("i",), detect_direction),
+    "adx": (("i",), lambda i: i["adx"].iloc[-1]),
+    "breakout": (("df",), detect_breakout),
+    "movement": (("i",), movement_reality),
+    "pullback_ready": (("i", "m5_direction"), detect_trend_pullback),
+    "range_edge": (("df", "i"), range_edge),
+    "profile": (("df", "i"), refresh_profile),
+    "regime": (("df", "i"), detect_regime),
+    "personality": (("df", "i"), lambda df, i: detect_market_personality(df, i, None)),
+    "environment": (("df", "i"), classify_market_environment),
+    "range_quality": (("i",), range_quality)
+}
+
+CONDITION_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "in": lambda value, options: value in options,
+    "is": operator.is_
+}
+
+# A pair is rejected by the first gate whose conditions all hold.
+GATES = [
+    {"name": "red_news", "when": [("red_news", "==", True)]},
+    {"name": "htf_neutral", "when": [("htf_direction", "in", (None, "NEUTRAL"))]},
+    {"name": "no_m5_data", "when": [("i", "is", None)]},
+    {"name": "chaotic", "when": [("movement", "==", "CHAOTIC"), ("cycle", "!=", "EXPANSION")]}
+]
+
+# First matching entry rule wins. Conditions are checked in order,
+# so put cheap features first.
+ENTRY_RULES = [
+    {"name": "trend_pullback", "signal": WITH_M5, "confidence": 90, "reason": "Trend pullback entry",
+     "when": [("cycle", "==", "TREND"), ("pullback_ready", "==", True)]},
+    {"name": "trend_early_buy", "signal": "BUY", "confidence": 75, "reason": "Early trend continuation",
+     "when": [("cycle", "==", "TREND"), ("m5_direction", "==", "BULLISH"), ("adx", ">", 18)]},
+    {"name": "trend_early_sell", "signal": "SELL", "confidence": 75, "reason": "Early trend continuation",
+     "when": [("cycle", "==", "TREND"), ("m5_direction", "==", "BEARISH"), ("adx", ">", 18)]},
+    {"name": "trend_momentum", "signal": WITH_M5, "confidence": 72, "reason": "Momentum continuation",
+     "when": [("cycle", "==", "TREND"), ("movement", "in", ("CLEAN", "MODERATE")), ("adx", ">", 22)]},
+
+    {"name": "range_support", "signal": "BUY", "confidence": 75, "reason": "Range support bounce",
+     "when": [("cycle", "==", "CONSOLIDATION"), ("range_edge", "==", "SUPPORT")]},
+    {"name": "range_resistance", "signal": "SELL", "confidence": 75, "reason": "Range resistance bounce",
+     "when": [("cycle", "==", "CONSOLIDATION"), ("range_edge", "==", "RESISTANCE")]},
+
+    {"name": "expansion_up", "signal": "BUY", "confidence": 85, "reason": "Range breakout",
+     "when": [("cycle", "==", "EXPANSION"), ("breakout", "==", "BREAKOUT_UP")]},
+    {"name": "expansion_down", "signal": "SELL", "confidence": 85, "reason": "Range breakout",
+     "when": [("cycle", "==", "EXPANSION"), ("breakout", "==", "BREAKOUT_DOWN")]},
+
+    {"name": "pre_breakout_up", "signal": "BUY", "confidence": 80, "reason": "Pre-breakout expansion",
+     "when": [("cycle", "==", "PRE_BREAKOUT"), ("breakout", "==", "BREAKOUT_UP")]},
+    {"name": "pre_breakout_down", "signal": "SELL", "confidence": 80, "reason": "Pre-breakout expansion",
+     "when": [("cycle", "==", "PRE_BREAKOUT"), ("breakout", "==", "BREAKOUT_DOWN")]},
+
+    {"name": "transition_up", "signal": "BUY", "confidence": 70, "reason": "Transition breakout",
+     "when": [("cycle", "==", "TRANSITION"), ("breakout", "==", "BREAKOUT_UP")]},
+    {"name": "transition_down", "signal": "SELL", "confidence": 70, "reason": "Transition breakout",
+     "when": [("cycle", "==", "TRANSITION"), ("breakout", "==", "BREAKOUT_DOWN")]}
+]
+
+# Features the scan reads itself (trade details, refresh scheduling)
+SCAN_FEATURES = ("df", "i", "cycle", "m5_direction", "htf_direction", "profile")
+
+def compile_rules(gates, entries, seeds=("asset", "symbol", "htf_direction")):
+    """
+    Drops disabled rules (`"enabled": False`) and resolves the features the
+    remaining ones need, dependencies first. Unknown feature names or
+    operators fail here rather than mid-scan.
+    """
+    gates = [g for g in gates if g.get("enabled", True)]
+    entries = [r for r in entries if r.get("enabled", True)]
+
+    order = []
+
+    def visit(name):
+        if name in order or name in seeds:
+            return
+        if name not in FEATURES:
+            raise KeyError(f"Unknown feature: {name}")
+        for dep in FEATURES[name][0]:
+            visit(dep)
+        order.append(name)
+
+    for rule in gates + entries:
+        for feature, op, _ in rule["when"]:
+            if op not in CONDITION_OPS:
+                raise KeyError(f"Unknown operator in {rule['name']}: {op}")
+            visit(feature)
+
+    for feature in SCAN_FEATURES:
+        visit(feature)
+
+    return {"gates": gates, "entries": entries, "features": order}
+
+class FeatureContext:
+    """
+    Lazily computes and memoises the features of one pair, so a feature
+    is only evaluated if a rule actually reaches it.
+    """
+
+    def __init__(self, plan, **seeds):
+        self.allowed = set(plan["features"]) | set(seeds)
+        self.values = dict(seeds)
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            if name not in self.allowed:
+                raise KeyError(f"Feature not in plan: {name}")
+            deps, fn = FEATURES[name]
+            self.values[name] = fn(*(self[dep] for dep in deps))
+        return self.values[name]
+
+    def peek(self, name):
+        """Value of `name` if it was already computed, else None."""
+        return self.values.get(name)
+
+def matches(conditions, ctx):
+    return all(CONDITION_OPS[op](ctx[feature], value) for feature, op, value in conditions)
+
+def evaluate_rules(plan, ctx):
+    """
+    Returns (signal, confidence, reason) from the first matching entry rule,
+    or None. Evaluation stops at the first gate that rejects the pair.
+    """
+    for gate in plan["gates"]:
+        if matches(gate["when"], ctx):
+            return None
+
+    for rule in plan["entries"]:
+        if matches(rule["when"], ctx):
+            signal = rule["signal"]
+            if signal == WITH_M5:
+                signal = "BUY" if ctx["m5_direction"] == "BULLISH" else "SELL"
+            return signal, rule["confidence"], rule["reason"]
+
+    return None
+
+RULE_PLAN = compile_rules(GATES, ENTRY_RULES)
+
+# ================= EVALUATION =================
+
+class ScanState:
+    """
+    What a scan carries over to the next one. The live monitor keeps one
+    instance shared by every session; a replay builds its own.
+    """
+
+    def __init__(self):
+        self.scheduler = RefreshScheduler(MARKETS)
+        self.evaluations = {}
+        self.correlation = RollingCorrelation(MARKETS)
+        self.lock = threading.Lock()
+        self.result = None
+        self.scans = 0
+
+def evaluation_key(ctx):
+    """
+    Everything a pair's evaluation depends on: news state and, when that
+    lets it through, its latest M5 candle and H1 direction.
+    """
+    if ctx["red_news"]:
+        return ("red_news",)
+
+    df = ctx["df"]
+    if df is None:
+        return ("no_data",)
+
+    return (ctx["htf_direction"], df.index[-1], tuple(df.iloc[-1].tolist()))
 
-    return best_trade
+def freshness(df):
+    """Staleness fields shown with a trade, from the frame it was read from."""
+    return {"stale": df.attrs.get("stale", False), "data_age": int(df.attrs.get("age", 0))}
+
+def entry_window():
+    """Entry at the close of the current M5 candle, expiry one candle later."""
+    entry_time = candle_boundary("5m")
+    expiry_time = entry_time + timedelta(minutes=5)
+    return {"entry": entry_time.strftime("%H:%M"), "expiry": expiry_time.strftime("%H:%M")}
+
+def evaluate_pair(asset, ctx):
+    """
+    Runs the rule plan for one pair. Returns its trade (or None) and what
+    the scheduler and correlation tracker need from the evaluation.
+    """
+    outcome = {"trade": None, "schedule": None, "close": None}
+
+    decision = evaluate_rules(RULE_PLAN, ctx)
+
+    if ctx.peek("i") is not None:
+        at_edge, volatility = ctx["profile"]
+        outcome["schedule"] = (ctx["cycle"], at_edge, volatility)
+        outcome["close"] = ctx["i"]["close"]
+
+    if decision is None:
+        return outcome
+
+    signal, confidence, reason = decision
+
+    df = ctx["df"]
+    cycle = ctx["cycle"]
+    m5_direction = ctx["m5_direction"]
+    htf_direction = ctx["htf_direction"]
+
+    # ===== HTF CONTEXT ADJUSTMENT =====
+
+    if signal == "BUY" and htf_direction == "BULLISH":
+        confidence += 10
+
+    elif signal == "SELL" and htf_direction == "BEARISH":
+        confidence += 10
+
+    else:
+        confidence -= 10
+
+    outcome["trade"] = {
+        "state": cycle,
+        "direction": m5_direction,
+        "asset": asset,
+        "signal": signal,
+        "confidence": confidence,
+        "personality": reason,
+        **entry_window(),
+        **freshness(df)
+    }
+
+    return outcome
+
+def scan_all_markets(state):
+    """
+    Runs one scan on `state`. Returns every signal of the current candle
+    with the correlation clusters, independent of any session: cooldowns
+    and per-cluster deduplication are applied by the viewer.
+    """
+    started = time.perf_counter()
+    closes = {}
+
+    st.session_state.scan_deadline = time.monotonic() + SCAN_TIME_BUDGET
+    provider().begin_scan()
+
+    scheduler = state.scheduler
+    evaluations = state.evaluations
+    now = provider().now()
+
+    # ===== STAGE 1: BATCHED H1 SCREEN =====
+    shortlist = screen_universe(MARKETS)
+
+    # ===== CORRELATION CLUSTERS =====
+    correlation = state.correlation
+    representatives = cluster_representatives(shortlist, correlation.clusters())
+
+    # a pair deferred as a cluster member is evaluated as soon as it
+    # becomes its cluster's representative
+    scheduler.promote(representatives, now)
+
+    # ===== STAGE 2: FULL M5 EVALUATION =====
+    for asset in scheduler.due(now, shortlist):
+
+        if asset not in representatives:
+            # A stronger correlated pair stands in for this one; only keep
+            # its closes current for the correlation matrix
+            metrics().inc("malagna_evaluations", result="clustered")
+            scheduler.remember(asset, now, None)
+            scheduler.defer(asset, now)
+
+            df = fetch(MARKETS[asset], "5m", "3d")
+            if df is not None:
+                closes[asset] = df["Close"].astype(float)
+            continue
+
+        scheduler.reschedule(asset, now)
+
+        ctx = FeatureContext(
+            RULE_PLAN, asset=asset, symbol=MARKETS[asset],
+            htf_direction=shortlist[asset][0]
+        )
+
+        # Only re-evaluate pairs whose inputs changed since the last scan
+        key = evaluation_key(ctx)
+        outcome = evaluations.get(asset)
+
+        if outcome is not None and outcome["key"] == key:
+            metrics().inc("malagna_evaluations", result="reused")
+
+            # same candles, but the frame may be fresher and the entry later now
+            if outcome["trade"]:
+                outcome["trade"] = {**outcome["trade"], **entry_window(), **freshness(ctx["df"])}
+        else:
+            metrics().inc("malagna_evaluations", result="evaluated")
+            outcome = {"key": key, **evaluate_pair(asset, ctx)}
+            evaluations[asset] = outcome
+
+            if outcome["close"] is not None:
+                closes[asset] = outcome["close"]
+            if outcome["trade"]:
+                metrics().inc("malagna_signals", state=outcome["trade"]["state"])
+
+        trade = outcome["trade"]
+        scheduler.remember(asset, now, trade)
+
+        if outcome["schedule"]:
+            cycle, at_edge, volatility = outcome["schedule"]
+            scheduler.reschedule(asset, now, cycle, at_edge or trade is not None, volatility)
+
+    correlation.update(closes)
+
+    metrics().inc("malagna_scans")
+    metrics().observe("malagna_scan_seconds", time.perf_counter() - started)
+    export_metrics()
+
+    return {"candidates": scheduler.current_trades(now), "clusters": correlation.clusters()}
+
+@st.cache_resource
+def live_scan():
+    return ScanState()
+
+def latest_scan(step=False):
+    """
+    Scan result for the current M5 candle. The first session to ask after a
+    close runs the scan; every other viewer renders the same result.
+    `step` scans again regardless (replay mode: one recorded scan per press).
+    """
+    state = live_scan()
+    boundary = candle_boundary("5m")
+
+    with state.lock:
+        if step or state.result is None or state.result["boundary"] != boundary:
+            state.scans += 1
+            state.result = {
+                **scan_all_markets(state),
+                "time": provider().now(),
+                "boundary": boundary,
+                "scan": state.scans
+            }
+        return state.result
 
 # ================= HEADER =================
 st.markdown("""
@@ -863,14 +1981,56 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-if st.button("Scan Market 🔍"):
+# ================= SIGNAL PANEL =================
+AUTO_REFRESH_SECONDS = 30
+
+def session_signals(result):
+    """
+    This session's view of a scan: pairs on cooldown are left out, then
+    the strongest signal per correlation cluster. Shown pairs go on cooldown.
+    """
+    candidates = [
+        trade for trade in result["candidates"]
+        if not pair_is_on_cooldown(trade["asset"])
+    ]
+    signals = strongest_per_cluster(candidates, result["clusters"])
+
+    for trade in signals:
+        st.session_state.pair_cooldown[trade["asset"]] = provider().now()
+
+    return signals
+
+live = st.toggle("Live monitor 📡", key="live_monitor",
+                 help="Rescans at every M5 close without reloading the page")
+
+@st.fragment(run_every=AUTO_REFRESH_SECONDS if live else None)
+def signal_panel():
+    """
+    Reruns on its own (button press or timer) without re-executing the
+    rest of the page, and renders from the shared scan of the current M5
+    candle. Cooldowns are applied once per new scan result. In replay mode
+    each press steps one recorded scan forward.
+    """
+    clicked = st.button("Scan Market 🔍")
+    last = st.session_state.get("last_scan")
+
+    if clicked or (live and (last is None or last["boundary"] != candle_boundary("5m"))):
+        result = latest_scan(step=clicked and PROVIDER_MODE == "replay")
+
+        if last is None or last["scan"] != result["scan"]:
+            last = st.session_state.last_scan = {
+                "signals": session_signals(result),
+                "time": result["time"],
+                "boundary": result["boundary"],
+                "scan": result["scan"]
+            }
+
+    if last is None:
+        return
+
+    # one signal per correlation cluster, strongest first
+    for k, best in enumerate(last["signals"]):
 
-    best = scan_all_markets()
-   
-    if best:
-    
-        st.session_state.pair_cooldown[best["asset"]] = datetime.now()
-    
         signal_class = {
             "BUY": "signal-buy",
             "SELL": "signal-sell"
@@ -879,7 +2039,7 @@ if st.button("Scan Market 🔍"):
         st.markdown(f"""
         <div class="block center">
             <div class="{signal_class}">{best['signal']}</div>
-            <div class="metric">Best Opportunity: {best['asset']}</div>
+            <div class="metric">{"Best Opportunity" if k == 0 else "Uncorrelated Opportunity"}: {best['asset']}</div>
             <div class="metric"><b>Confidence:</b> {best['confidence']}%</div>
             <div class="small">
                 State: {best['state']} • 
@@ -887,12 +2047,46 @@ if st.button("Scan Market 🔍"):
                 Personality: {best['personality']}
                 🟢 Entry: {best['entry']}<br>
                 🔴 Expiry: {best['expiry']}
+                {f"<br>⏳ Data age: {best['data_age']}s (refreshing)" if best['stale'] else ""}
             </div>
         """, unsafe_allow_html=True)
 
-    else:
+    if not last["signals"]:
         st.warning("No valid trade found right now. Market may be in cooldown or low quality.")
 
+    st.caption(f"Last scan: {last['time'].strftime('%H:%M:%S')} UTC")
+
+signal_panel()
+
+# ================= REPLAY =================
+if PROVIDER_MODE == "replay":
+    st.caption(
+        f"{provider().remaining_scans()} of {len(provider().scans)} recorded scans left "
+        "(each Scan Market steps one forward)"
+    )
+
+if PROVIDER_MODE == "replay" and st.button("Replay Session ⏪"):
+
+    # always replay from the start, on fresh scan state and cooldowns
+    provider().rewind()
+    state = ScanState()
+    st.session_state.pair_cooldown = {}
+
+    started = time.perf_counter()
+    first = provider().now()
+    rows = []
+
+    while provider().remaining_scans():
+
+        for best in session_signals(scan_all_markets(state)):
+            rows.append({"time": provider().now().strftime("%H:%M:%S"), **best})
+
+    elapsed = time.perf_counter() - started
+    span = (provider().now() - first).total_seconds()
+
+    st.dataframe(pd.DataFrame(rows))
+    st.caption(f"Replayed {span:.0f}s of recorded session in {elapsed:.1f}s")
+
 # ================= USER NOTE =================
 st.markdown("""
 <div class="block small">
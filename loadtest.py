@@ -0,0 +1,481 @@
+"""
+Concurrent-user load test for the Malagna dashboard.
+
+Starts the app on a real Streamlit server with Yahoo Finance and Forex
+Factory replaced by local stub servers, connects N websocket sessions that
+log in and press "Scan Market 🔍" at the same moment, and reports scan
+latency, server CPU / memory and request fan-out to the data sources.
+
+    python loadtest.py --sessions 20 --scans 3 --stub-latency 0.2 --new-candle
+
+All sessions press at once, so the first press of a round waits for the one
+shared scan of that M5 candle and later rounds in the same candle only
+render the cached result. The two are reported separately; --new-candle
+moves a stub clock (shared by the app and the stubs) one candle forward
+between rounds so every round measures a real scan. Real scans are counted
+from the app's malagna_scans metric, and fan-out is reported per real scan.
+
+Needs the packages in requirements-dev.txt and Linux (/proc) for server
+CPU / memory.
+
+Yahoo fan-out is counted at the chart-request level: yfinance.Ticker and
+yfinance.download are replaced in the server process by stubs that make
+one HTTP request per symbol, as yfinance does for chart data. yfinance's
+own cookie / crumb handshakes are not emulated and not counted.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+import numpy as np
+import pandas as pd
+import requests
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+APP_PASSWORD = "malagna2026"
+
+CANDLE_SECONDS = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "1d": 86400}
+
+CALENDAR_HTML = """
+<table>
+<tr class="calendar__row">
+  <td class="calendar__time time">03:00</td>
+  <td class="calendar__currency currency">JPY</td>
+  <td class="calendar__impact impact"><span class="high"></span></td>
+</tr>
+</table>
+"""
+
+# ================= STUB CLOCK =================
+
+def stub_time(clock_path):
+    """Wall-clock time plus the offset stored in `clock_path`."""
+    with open(clock_path) as f:
+        return time.time() + float(f.read() or 0)
+
+def advance_clock(clock_path, seconds):
+    with open(clock_path) as f:
+        offset = float(f.read() or 0)
+    with open(clock_path, "w") as f:
+        f.write(str(offset + seconds))
+
+def install_clock(clock_path):
+    """
+    Makes datetime.now() in the server process follow the stub clock. app.py
+    imports `datetime` on every run, so it picks up the replacement.
+    """
+    import datetime
+
+    class StubDatetime(datetime.datetime):
+
+        @classmethod
+        def now(cls, tz=None):
+            offset = stub_time(clock_path) - time.time()
+            return super().now(tz) + datetime.timedelta(seconds=offset)
+
+    datetime.datetime = StubDatetime
+
+# ================= STUB SERVERS =================
+
+def synthetic_candles(symbol, interval, period, now):
+    """Deterministic random-walk candles ending at the candle forming at `now`."""
+    step = CANDLE_SECONDS[interval]
+    count = int(period.rstrip("d")) * 86400 // step
+
+    end = int(now) // step * step
+    index = np.arange(end - (count - 1) * step, end + 1, step)
+
+    rng = np.random.default_rng(zlib.crc32(f"{symbol}{interval}".encode()))
+    close = 100 * np.exp(np.cumsum(rng.normal(rng.normal(0, 3e-4), 1e-3, count)))
+    spread = rng.uniform(1e-4, 1e-3, count)
+
+    return {
+        "index": index.tolist(),
+        "Open": close.tolist(),
+        "High": (close * (1 + spread)).tolist(),
+        "Low": (close * (1 - spread)).tolist(),
+        "Close": close.tolist(),
+        "Volume": [0] * count
+    }
+
+def run_stubs(latency, ports, clock_path):
+    counts = {"yahoo": 0, "calendar": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def reply(self, body, content_type):
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+
+            if url.path == "/stats":
+                with lock:
+                    self.reply(json.dumps(counts), "application/json")
+                return
+
+            time.sleep(latency)
+
+            if url.path.startswith("/chart/"):
+                with lock:
+                    counts["yahoo"] += 1
+                query = parse_qs(url.query)
+                candles = synthetic_candles(
+                    url.path[len("/chart/"):], query["interval"][0], query["range"][0],
+                    stub_time(clock_path)
+                )
+                self.reply(json.dumps(candles), "application/json")
+                return
+
+            if url.path == "/calendar":
+                with lock:
+                    counts["calendar"] += 1
+                self.reply(CALENDAR_HTML, "text/html")
+                return
+
+            self.send_error(404)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+def start_stubs(latency, clock_path):
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=run_stubs, args=(latency, ports, clock_path), daemon=True
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{ports.get(timeout=30)}"
+
+def stub_stats(base_url):
+    return requests.get(f"{base_url}/stats", timeout=10).json()
+
+def install_yahoo_stub(base_url):
+    """
+    Replaces yfinance.Ticker and yfinance.download with stubs that fetch
+    candles from the stub server, one request per symbol as yfinance does.
+    Real yfinance is not used, so its session handshakes are not counted.
+    """
+    import yfinance
+
+    def frame(symbol, interval, period):
+        res = requests.get(
+            f"{base_url}/chart/{quote(symbol)}",
+            params={"interval": interval, "range": period},
+            timeout=60
+        )
+        data = res.json()
+        index = pd.to_datetime(data.pop("index"), unit="s", utc=True)
+        return pd.DataFrame(data, index=index)
+
+    class StubTicker:
+
+        def __init__(self, symbol, *args, **kwargs):
+            self.symbol = symbol
+
+        def history(self, interval="1d", period="1mo", **kwargs):
+            return frame(self.symbol, interval, period)
+
+    def download(tickers, interval="1d", period="1mo", **kwargs):
+        symbols = tickers.split() if isinstance(tickers, str) else list(tickers)
+        frames = {symbol: frame(symbol, interval, period) for symbol in symbols}
+        df = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+        df.columns.names = ["Price", "Ticker"]
+        return df
+
+    yfinance.Ticker = StubTicker
+    yfinance.download = download
+
+# ================= SERVER =================
+
+def serve(port, stub_url, clock_path):
+    """
+    Runs app.py on a Streamlit server whose yfinance talks to the stubs
+    and whose clock follows the stub clock.
+    """
+    install_yahoo_stub(stub_url)
+    install_clock(clock_path)
+
+    from streamlit.web import bootstrap
+
+    flags = {
+        "server.port": port,
+        "server.address": "127.0.0.1",
+        "server.headless": True,
+        "server.fileWatcherType": "none",
+        "browser.gatherUsageStats": False
+    }
+    bootstrap.load_config_options(flag_options=flags)
+    bootstrap.run(APP_PATH, False, [], flags)
+
+def start_server(port, metrics_port, stub_url, clock_path):
+    env = dict(
+        os.environ,
+        MALAGNA_CALENDAR_URL=f"{stub_url}/calendar",
+        MALAGNA_PROVIDER="live",
+        MALAGNA_METRICS_PORT=str(metrics_port)
+    )
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port),
+         "--stub-url", stub_url, "--clock", clock_path],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError("Streamlit server did not start")
+
+def scans_run(metrics_port):
+    """Real scans so far, from the app's malagna_scans counter."""
+    try:
+        text = requests.get(f"http://127.0.0.1:{metrics_port}/metrics", timeout=10).text
+    except requests.RequestException:
+        # the exporter starts with the first session
+        return 0
+
+    for line in text.splitlines():
+        if line.startswith("malagna_scans_total "):
+            return int(float(line.split()[1]))
+    return 0
+
+class ProcessMonitor:
+    """CPU time and peak RSS of a process, read from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def memory_mb(self, field):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+        return float("nan")
+
+# ================= SESSIONS =================
+
+class Session:
+    """
+    Minimal Streamlit browser client: sends rerun requests with widget
+    states over the websocket and reads back elements until the run ends.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}
+        self.errors = []
+
+    async def rerun(self, widgets=(), fragment_id=""):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        msg = BackMsg()
+        msg.rerun_script.fragment_id = fragment_id
+        for state in widgets:
+            msg.rerun_script.widget_states.widgets.append(state)
+
+        await self.ws.send(msg.SerializeToString())
+        await self.wait_finished()
+
+    async def wait_finished(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.ws.recv())
+            kind = msg.WhichOneof("type")
+
+            if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                element = msg.delta.new_element
+                widget = element.WhichOneof("type")
+
+                if widget in ("button", "text_input"):
+                    proto = getattr(element, widget)
+                    self.widgets[proto.label] = (proto.id, msg.delta.fragment_id)
+                elif widget == "exception":
+                    self.errors.append(element.exception.message)
+
+            if kind == "script_finished" and msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    def widget(self, prefix):
+        for label, found in self.widgets.items():
+            if label.startswith(prefix):
+                return found
+        raise LookupError(f"No widget labelled {prefix!r}")
+
+async def run_session(url, scans, barrier, latencies, errors, clock_path, new_candle):
+    import websockets
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    failed = None
+
+    try:
+        ws = await websockets.connect(url, subprotocols=["streamlit"], max_size=None)
+        session = Session(ws)
+
+        await session.rerun()
+
+        password_id, _ = session.widget("Password")
+        await session.rerun([WidgetState(id=password_id, string_value=APP_PASSWORD)])
+
+        scan_id, fragment_id = session.widget("Scan Market")
+    except Exception as e:
+        failed = repr(e)
+        errors.append(failed)
+
+    for round in range(scans):
+        # keep joining the barriers after a failure so other sessions don't hang
+        if round and new_candle:
+            if await barrier.wait() == 0:
+                advance_clock(clock_path, CANDLE_SECONDS["5m"])
+        await barrier.wait()
+
+        if failed:
+            continue
+
+        # the first round of a candle waits on its shared scan; later ones
+        # render the cached result
+        kind = "scan" if round == 0 or new_candle else "cached"
+
+        try:
+            started = time.perf_counter()
+            await session.rerun([WidgetState(id=scan_id, trigger_value=True)], fragment_id)
+            latencies[kind].append(time.perf_counter() - started)
+        except Exception as e:
+            failed = repr(e)
+            errors.append(failed)
+
+    if not failed:
+        errors.extend(session.errors)
+        await ws.close()
+
+async def run_sessions(url, sessions, scans, latencies, errors, clock_path, new_candle):
+    barrier = asyncio.Barrier(sessions)
+    await asyncio.gather(*(
+        run_session(url, scans, barrier, latencies, errors, clock_path, new_candle)
+        for _ in range(sessions)
+    ))
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+def latency_report(prefix, values):
+    return {
+        f"{prefix}_presses": len(values),
+        f"{prefix}_p50": round(percentile(values, 50), 3),
+        f"{prefix}_p90": round(percentile(values, 90), 3),
+        f"{prefix}_p99": round(percentile(values, 99), 3),
+        f"{prefix}_max": round(max(values, default=float("nan")), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--scans", type=int, default=3, help="Scan Market presses per session")
+    parser.add_argument("--stub-latency", type=float, default=0.1,
+                        help="seconds each stub request takes")
+    parser.add_argument("--new-candle", action="store_true",
+                        help="move the stub clock one M5 candle forward between rounds")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--metrics-port", type=int, default=8598)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--stub-url", help=argparse.SUPPRESS)
+    parser.add_argument("--clock", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.stub_url, args.clock)
+        return
+
+    fd, clock_path = tempfile.mkstemp(prefix="malagna-clock-")
+    os.close(fd)
+
+    stubs, stub_url = start_stubs(args.stub_latency, clock_path)
+    server = start_server(args.port, args.metrics_port, stub_url, clock_path)
+    monitor = ProcessMonitor(server.pid)
+
+    latencies, errors = {"scan": [], "cached": []}, []
+
+    try:
+        baseline_rss = monitor.memory_mb("VmRSS")
+        cpu_before = monitor.cpu_seconds()
+        started = time.perf_counter()
+
+        asyncio.run(run_sessions(
+            f"ws://127.0.0.1:{args.port}/_stcore/stream",
+            args.sessions, args.scans, latencies, errors, clock_path, args.new_candle
+        ))
+
+        wall = time.perf_counter() - started
+        cpu = monitor.cpu_seconds() - cpu_before
+        peak_rss = monitor.memory_mb("VmHWM")
+        fanout = stub_stats(stub_url)
+        total_scans = scans_run(args.metrics_port)
+    finally:
+        server.terminate()
+        stubs.terminate()
+        os.remove(clock_path)
+
+    report = {
+        "sessions": args.sessions,
+        "presses": len(latencies["scan"]) + len(latencies["cached"]),
+        "scans": total_scans,
+        "errors": len(errors),
+        "wall_seconds": round(wall, 2),
+        **latency_report("scan_latency", latencies["scan"]),
+        **latency_report("cached_latency", latencies["cached"]),
+        "server_cpu_seconds": round(cpu, 2),
+        "server_cpu_utilisation": round(cpu / wall, 2) if wall else None,
+        "server_rss_start_mb": round(baseline_rss, 1),
+        "server_rss_peak_mb": round(peak_rss, 1),
+        "yahoo_chart_requests": fanout["yahoo"],
+        "calendar_requests": fanout["calendar"],
+        "yahoo_chart_per_scan": round(fanout["yahoo"] / total_scans, 2) if total_scans else None,
+        "calendar_per_scan": round(fanout["calendar"] / total_scans, 2) if total_scans else None
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f"{key:>24}: {value}")
+        print("(Yahoo counts are chart requests per symbol; yfinance cookie/crumb requests are not included)")
+
+    for error in errors[:5]:
+        print(error)
+
+if __name__ == "__main__":
+    main()
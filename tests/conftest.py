@@ -0,0 +1,97 @@
+"""
+Imports app.py against a minimal stand-in for streamlit, so the module's
+functions can be tested without a Streamlit runtime. Widgets return their
+"untouched" values, so the page body runs without scanning anything.
+"""
+
+import functools
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SessionState(dict):
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+def decorator(cache=None):
+    """Supports both @st.cache_x and @st.cache_x(...)."""
+
+    def make(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return cache(args[0]) if cache else args[0]
+        return make
+
+    return make
+
+
+def stub_streamlit():
+    st = types.ModuleType("streamlit")
+    st.session_state = SessionState(auth=True)
+
+    for name in ("set_page_config", "markdown", "caption", "warning", "error",
+                 "dataframe", "stop", "rerun"):
+        setattr(st, name, lambda *args, **kwargs: None)
+
+    st.text_input = lambda *args, **kwargs: ""
+    st.button = lambda *args, **kwargs: False
+    st.toggle = lambda *args, **kwargs: False
+
+    st.cache_data = decorator()
+    st.cache_resource = decorator(functools.lru_cache(maxsize=None))
+    st.fragment = lambda *args, **kwargs: (lambda fn: fn)
+
+    return st
+
+
+@pytest.fixture(scope="session")
+def app():
+    os.environ["MALAGNA_PROVIDER"] = "live"
+    sys.modules["streamlit"] = stub_streamlit()
+    sys.path.insert(0, ROOT)
+
+    import app as module
+    return module
+
+
+def synthetic_candles(seed, n=400, freq="5min", end="2026-01-05 12:00"):
+    """
+    OHLC random walk whose drift and volatility change every 100 candles,
+    so trends, ranges and breakouts all show up.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    blocks = -(-n // 100)
+    drift = np.repeat(rng.normal(0, 0.0006, blocks), 100)[:n]
+    vol = np.repeat(rng.uniform(0.0001, 0.0015, blocks), 100)[:n]
+
+    close = 100 * np.exp(np.cumsum(drift + vol * rng.standard_normal(n)))
+    spread = close * vol * rng.uniform(0.2, 1.5, n)
+    index = pd.date_range(end=pd.Timestamp(end, tz="UTC"), periods=n, freq=freq)
+
+    return pd.DataFrame({
+        "Open": np.r_[close[0], close[:-1]],
+        "High": close + spread,
+        "Low": close - spread,
+        "Close": close,
+        "Volume": np.ones(n)
+    }, index=index)
+
+
+@pytest.fixture
+def candles():
+    return synthetic_candles
@@ -0,0 +1,66 @@
+"""
+RollingCorrelation updates running sums candle by candle; the result must
+match a full pandas recompute over the same window.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+ASSETS = ["EUR/JPY", "GBP/JPY", "AUD/JPY", "EUR/USD", "Gold"]
+
+
+def closes(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2026-01-05", periods=n, freq="5min", tz="UTC")
+
+    yen = rng.normal(0, 1e-3, n)
+    returns = {
+        asset: yen * ("JPY" in asset) + rng.normal(0, 2e-4 if "JPY" in asset else 1e-3, n)
+        for asset in ASSETS
+    }
+    return pd.DataFrame({a: 100 * np.exp(np.cumsum(r)) for a, r in returns.items()}, index=index)
+
+
+def test_incremental_matches_full_recompute(app):
+    frame = closes()
+    window = 100
+    tracker = app.RollingCorrelation(ASSETS, window=window)
+
+    # fed in uneven chunks, as scans would
+    for end in (150, 151, 200, 260, 400):
+        tracker.update({a: frame[a].iloc[:end] for a in ASSETS})
+
+        expected = frame.iloc[:end].pct_change().iloc[1:].iloc[-window:].corr()
+        np.testing.assert_allclose(tracker.matrix().to_numpy(), expected.to_numpy(), atol=1e-9)
+
+
+def test_correlated_pairs_share_a_cluster(app):
+    frame = closes()
+    tracker = app.RollingCorrelation(ASSETS)
+    tracker.update({a: frame[a] for a in ASSETS})
+
+    clusters = tracker.clusters()
+
+    assert clusters["EUR/JPY"] == clusters["GBP/JPY"] == clusters["AUD/JPY"]
+    assert len({clusters["EUR/JPY"], clusters["EUR/USD"], clusters["Gold"]}) == 3
+
+
+def test_one_representative_per_cluster(app):
+    clusters = {"EUR/JPY": 0, "GBP/JPY": 0, "EUR/USD": 1}
+    shortlist = {"EUR/JPY": ("BULLISH", 21.0), "GBP/JPY": ("BULLISH", 30.0), "EUR/USD": ("BEARISH", 18.0)}
+
+    assert app.cluster_representatives(shortlist, clusters) == {"GBP/JPY", "EUR/USD"}
+
+
+def test_strongest_signal_per_cluster(app):
+    clusters = {"EUR/JPY": 0, "GBP/JPY": 0, "EUR/USD": 1}
+    trades = [
+        {"asset": "EUR/JPY", "confidence": 85},
+        {"asset": "GBP/JPY", "confidence": 75},
+        {"asset": "EUR/USD", "confidence": 80}
+    ]
+
+    ranked = app.strongest_per_cluster(trades, clusters)
+
+    assert [t["asset"] for t in ranked] == ["EUR/JPY", "EUR/USD"]
@@ -0,0 +1,114 @@
+"""
+The declarative rule set must give the same signals as the if/elif entry
+tree it replaced (reproduced below from before the rewrite).
+"""
+
+import pandas as pd
+import pytest
+
+
+def legacy_entry(app, df, i, htf_direction):
+    """Entry logic of scan_all_markets before the rule set, after its gates."""
+    cycle = app.detect_market_cycle(df, i)
+    m5_direction = app.detect_direction(i)
+
+    adx = i["adx"].iloc[-1]
+    breakout = app.detect_breakout(df)
+    movement = app.movement_reality(i)
+
+    if movement == "CHAOTIC" and cycle != "EXPANSION":
+        return None
+
+    pullback_ready = app.detect_trend_pullback(i, m5_direction)
+
+    signal = None
+    confidence = 0
+    reason = ""
+
+    if cycle == "TREND":
+        if pullback_ready:
+            signal = "BUY" if m5_direction == "BULLISH" else "SELL"
+            confidence, reason = 90, "Trend pullback entry"
+        elif m5_direction == "BULLISH" and adx > 18:
+            signal, confidence, reason = "BUY", 75, "Early trend continuation"
+        elif m5_direction == "BEARISH" and adx > 18:
+            signal, confidence, reason = "SELL", 75, "Early trend continuation"
+        elif movement in ["CLEAN", "MODERATE"] and adx > 22:
+            signal = "BUY" if m5_direction == "BULLISH" else "SELL"
+            confidence, reason = 72, "Momentum continuation"
+
+    elif cycle == "CONSOLIDATION":
+        resistance = float(df["High"].astype(float).iloc[-20:].max())
+        support = float(df["Low"].astype(float).iloc[-20:].min())
+        price = float(i["close"].iloc[-1])
+
+        if price <= support * 1.002:
+            signal, confidence, reason = "BUY", 75, "Range support bounce"
+        elif price >= resistance * 0.998:
+            signal, confidence, reason = "SELL", 75, "Range resistance bounce"
+
+    else:
+        breakouts = {
+            "EXPANSION": (85, "Range breakout"),
+            "PRE_BREAKOUT": (80, "Pre-breakout expansion"),
+            "TRANSITION": (70, "Transition breakout")
+        }
+        if cycle in breakouts and breakout in ("BREAKOUT_UP", "BREAKOUT_DOWN"):
+            signal = "BUY" if breakout == "BREAKOUT_UP" else "SELL"
+            confidence, reason = breakouts[cycle]
+
+    if not signal:
+        return None
+
+    if (signal, htf_direction) in (("BUY", "BULLISH"), ("SELL", "BEARISH")):
+        confidence += 10
+    else:
+        confidence -= 10
+
+    return signal, confidence, reason
+
+
+def evaluations(candles):
+    """200 (frame, H1 direction) cases: 50 series, 4 windows each."""
+    for seed in range(50):
+        df = candles(seed, n=700)
+        for end in (400, 500, 600, 700):
+            yield df.iloc[:end], ("BULLISH", "BEARISH")[(seed + end) % 2]
+
+
+def test_rules_match_legacy_entry_tree(app, candles):
+    fired = []
+
+    for df, htf_direction in evaluations(candles):
+        df = df.copy()
+        df.attrs.update(boundary=df.index[-1] + pd.Timedelta(minutes=10), age=0.0, stale=False)
+
+        ctx = app.FeatureContext(
+            app.RULE_PLAN, asset="EUR/USD", symbol="EURUSD=X",
+            htf_direction=htf_direction, red_news=False, df=df
+        )
+        trade = app.evaluate_pair("EUR/USD", ctx)["trade"]
+        got = trade and (trade["signal"], trade["confidence"], trade["personality"])
+
+        expected = legacy_entry(app, df, app.indicators(df), htf_direction)
+        assert got == expected
+
+        if expected:
+            fired.append(expected[2])
+
+    # the comparison must cover several entry rules, not just "no signal"
+    assert len(set(fired)) >= 3
+
+
+def test_unknown_feature_fails_at_compile_time(app):
+    gates = [{"name": "bad", "when": [("no_such_feature", "==", True)]}]
+
+    with pytest.raises(KeyError):
+        app.compile_rules(gates, [])
+
+
+def test_disabled_rules_are_dropped(app):
+    entries = [dict(rule, enabled=False) for rule in app.ENTRY_RULES]
+    plan = app.compile_rules(app.GATES, entries)
+
+    assert plan["entries"] == []
@@ -0,0 +1,31 @@
+"""
+Refresh scheduling and the shared request budget.
+"""
+
+from datetime import datetime
+
+import pytz
+
+
+NOW = datetime(2026, 1, 5, 10, 1, tzinfo=pytz.UTC)
+
+
+class Clock:
+
+    def __init__(self, now):
+        self.clock = now
+
+    def now(self):
+        return self.clock
+
+
+def test_batch_download_costs_one_request_per_symbol(app, monkeypatch):
+    clock = Clock(NOW)
+    monkeypatch.setattr(app, "provider", lambda: clock)
+    budget = app.RequestBudget(per_minute=40, burst=80)
+    monkeypatch.setattr(app, "request_budget", lambda: budget)
+
+    app.charge_request_budget(tuple(f"S{k}" for k in range(39)), "1h")
+    app.charge_request_budget("EURUSD=X", "5m")
+
+    assert budget.tokens == 80 - 39 - 1
@@ -0,0 +1,48 @@
+"""
+The column-wise stage-1 screen must agree with the per-pair H1 check
+(detect_direction on ta indicators plus the ADX filter), including for
+symbols with gaps in the batched frame.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def batch(symbols, n=720):
+    index = pd.date_range("2026-09-01", periods=n, freq="1h", tz="UTC")
+    columns = {}
+
+    for k, symbol in enumerate(symbols):
+        rng = np.random.default_rng(k)
+        close = 100 * np.exp(np.cumsum(rng.normal(rng.normal(0, 4e-4), 2e-3, n)))
+        columns[("Close", symbol)] = close
+        columns[("High", symbol)] = close * (1 + rng.uniform(0, 2e-3, n))
+        columns[("Low", symbol)] = close * (1 - rng.uniform(0, 2e-3, n))
+
+    df = pd.DataFrame(columns, index=index)
+    df.columns = pd.MultiIndex.from_tuples(df.columns, names=["Price", "Ticker"])
+
+    # weekend-like gap for every other symbol
+    for symbol in symbols[::2]:
+        df.loc[df.index[100:148], (slice(None), symbol)] = np.nan
+
+    return df
+
+
+def test_screen_matches_per_pair_direction(app):
+    symbols = tuple(f"S{k}" for k in range(40))
+    df = batch(symbols)
+
+    screened = app._screen(symbols, None, df)
+
+    for symbol in symbols:
+        one = df.xs(symbol, axis=1, level="Ticker").dropna()
+        i = app.indicators(one)
+
+        direction = app.detect_direction(i)
+        strong = i["adx"].iloc[-1] > app.SCREEN_MIN_ADX
+        expected = direction if strong and direction != "NEUTRAL" else None
+
+        assert screened[symbol][0] == expected, symbol
+        assert screened[symbol][1] == pytest.approx(i["adx"].iloc[-1]), symbol
@@ -0,0 +1,80 @@
+"""
+Stale-while-revalidate fetches: after a candle closes the refreshed frame
+should be served when it arrives quickly, the stale one otherwise, and
+signal entry times always follow the current candle.
+"""
+
+import time
+from datetime import datetime
+
+import pandas as pd
+import pytest
+import pytz
+
+from conftest import synthetic_candles
+
+
+class FakeProvider:
+
+    def __init__(self, now, delay=0.0):
+        self.clock = now
+        self.delay = delay
+
+    def now(self):
+        return self.clock
+
+    def download(self, symbol, interval, period):
+        time.sleep(self.delay)
+        # like Yahoo, includes the candle that is still forming
+        end = pd.Timestamp(self.clock).floor("5min")
+        return synthetic_candles(0, n=300, end=str(end.tz_convert(None)))
+
+
+@pytest.fixture
+def fake(app, monkeypatch):
+    fake = FakeProvider(datetime(2026, 1, 5, 10, 5, 30, tzinfo=pytz.UTC))
+    monkeypatch.setattr(app, "provider", lambda: fake)
+    yield fake
+
+    # background refreshes must finish while the fake is still installed
+    for future in list(app.candle_store().inflight.values()):
+        future.exception()
+
+
+def test_refresh_served_after_close(app, fake):
+
+    df = app.fetch_swr("SWR1", "5m", "3d", app.candle_boundary("5m"))
+    assert df.index[-1] == pd.Timestamp("2026-01-05 10:00", tz="UTC")
+
+    fake.clock = datetime(2026, 1, 5, 10, 10, 30, tzinfo=pytz.UTC)
+    df = app.fetch_swr("SWR1", "5m", "3d", app.candle_boundary("5m"))
+
+    assert df.index[-1] == pd.Timestamp("2026-01-05 10:05", tz="UTC")
+    assert not df.attrs["stale"]
+
+
+def test_slow_refresh_serves_stale_frame(app, fake, monkeypatch):
+    monkeypatch.setattr(app, "HEDGE_AFTER", 0.1)
+
+    app.fetch_swr("SWR2", "5m", "3d", app.candle_boundary("5m"))
+
+    fake.clock = datetime(2026, 1, 5, 10, 10, 30, tzinfo=pytz.UTC)
+    fake.delay = 1.0
+    df = app.fetch_swr("SWR2", "5m", "3d", app.candle_boundary("5m"))
+
+    assert df.index[-1] == pd.Timestamp("2026-01-05 10:00", tz="UTC")
+    assert df.attrs["stale"]
+
+    # the entry is the close of the current candle, not the frame's
+    assert app.entry_window() == {"entry": "10:15", "expiry": "10:20"}
+
+
+def test_frames_too_far_behind_are_dropped(app, fake, monkeypatch):
+    monkeypatch.setattr(app, "HEDGE_AFTER", 0.1)
+
+    app.fetch_swr("SWR3", "5m", "3d", app.candle_boundary("5m"))
+
+    fake.clock = datetime(2026, 1, 5, 10, 30, 30, tzinfo=pytz.UTC)
+    fake.delay = 1.0
+
+    assert app.fetch_swr("SWR3", "5m", "3d", app.candle_boundary("5m")) is None